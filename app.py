@@ -1,9 +1,17 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, send_file, Response, g, has_request_context
 import sqlite3
 from datetime import datetime
 import re
 import json
 import threading
+import queue
+import time
+import hashlib
+import argparse
+import signal
+import sys
+import importlib
+import subprocess
 import csv
 from io import StringIO
 import os
@@ -20,24 +28,71 @@ if not os.path.exists(UPLOAD_FOLDER):
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_ASSINANTES'] = None  # streams SSE simultâneos por processo; None = sem limite
+
+INTERVALO_EVENTOS = 1.0  # segundos entre verificações de PRAGMA data_version
+MAX_ALTERACOES = 1000  # linhas mantidas no log de alterações
+FICHAS_POR_PAGINA = 5  # fichas carregadas de início na página do cliente
+LIMITE_API = 100  # máximo de itens por página na API JSON
+CONEXOES_AQUECIDAS = 4  # conexões de leitura preparadas por worker antes de aceitar tráfego
+TENTATIVAS_AQUECIMENTO = 4  # tentativas (com espera dobrando a partir de 1s) antes de o worker desistir
+TEMPO_ENCERRAMENTO = 10  # segundos que um worker espera requisições em andamento ao encerrar
+THREADS_RESERVADAS = 4  # threads de cada worker que streams SSE nunca ocupam (requisições comuns, /saude)
+ESPERA_EVENTOS_LOTADO = 30  # segundos até o navegador tentar o stream de novo quando o worker está lotado
+RETENCAO_EXCLUIDOS = '-30 days'  # por quanto tempo registros excluídos ficam recuperáveis
+LOTE_EXPURGO = 200  # linhas por transação no expurgo, para não segurar o lock de escrita
+PAUSA_EXPURGO = 0.05  # segundos entre lotes do expurgo
+INTERVALO_EXPURGO = 3600  # segundos entre execuções do expurgo
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 _thread_local = threading.local()
+_pool = queue.LifoQueue()
+
+def _nova_conexao():
+    """Abre conexão SQLite com configurações otimizadas para evitar locks"""
+    conn = sqlite3.connect('reabilitacao.db', timeout=30.0, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode = WAL')  
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA cache_size = -64000')  
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.row_factory = sqlite3.Row
+    return conn
 
 def get_db():
-    """Obtém conexão SQLite com configurações otimizadas para evitar locks"""
+    """Obtém conexão do pool durante requisições; fora delas, uma conexão por thread"""
+    if has_request_context():
+        if 'db' not in g:
+            try:
+                g.db = _pool.get_nowait()
+            except queue.Empty:
+                g.db = _nova_conexao()
+        return g.db
+    
     if not hasattr(_thread_local, 'db'):
-        conn = sqlite3.connect('reabilitacao.db', timeout=30.0, check_same_thread=False)
-        conn.execute('PRAGMA journal_mode = WAL')  
-        conn.execute('PRAGMA synchronous = NORMAL')
-        conn.execute('PRAGMA cache_size = -64000')  
-        conn.execute('PRAGMA temp_store = MEMORY')
-        conn.row_factory = sqlite3.Row
-        _thread_local.db = conn
+        _thread_local.db = _nova_conexao()
     return _thread_local.db
 
+@app.teardown_request
+def devolver_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put(conn)
+
+def fechar_db():
+    """Fecha as conexões deste processo (necessário antes de um fork)"""
+    if hasattr(_thread_local, 'db'):
+        _thread_local.db.close()
+        del _thread_local.db
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
 def init_db():
     conn = get_db()
     cursor = conn.cursor()
@@ -46,7 +101,7 @@ def init_db():
         CREATE TABLE IF NOT EXISTS clientes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             nome TEXT NOT NULL,
-            cpf TEXT NOT NULL UNIQUE,
+            cpf TEXT NOT NULL,
             email TEXT NOT NULL,
             telefone TEXT NOT NULL
         )
@@ -104,6 +159,68 @@ def init_db():
         )
     ''')
     
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alteracoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cliente_id INTEGER NOT NULL,
+            acao TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Versão do cliente, incrementada a cada escrita; base dos ETags da API
+    colunas = [c[1] for c in cursor.execute('PRAGMA table_info(clientes)').fetchall()]
+    if 'versao' not in colunas:
+        cursor.execute('ALTER TABLE clientes ADD COLUMN versao INTEGER NOT NULL DEFAULT 0')
+    
+    # Soft delete: deleted_at marca o registro como excluído até o expurgo
+    for tabela in ('clientes', 'fichas', 'medicamentos', 'familiares', 'documentos'):
+        colunas = [c[1] for c in cursor.execute(f'PRAGMA table_info({tabela})').fetchall()]
+        if 'deleted_at' not in colunas:
+            cursor.execute(f'ALTER TABLE {tabela} ADD COLUMN deleted_at TEXT')
+    
+    # CPF único apenas entre clientes não excluídos: bancos antigos têm UNIQUE na coluna
+    # e a tabela precisa ser recriada (SQLite não remove constraints com ALTER TABLE)
+    esquema = cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='clientes'").fetchone()[0]
+    if 'UNIQUE' in esquema:
+        cursor.execute('BEGIN IMMEDIATE')
+        sequencia = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name='clientes'").fetchone()
+        cursor.execute('''
+            CREATE TABLE clientes_novo (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome TEXT NOT NULL,
+                cpf TEXT NOT NULL,
+                email TEXT NOT NULL,
+                telefone TEXT NOT NULL,
+                versao INTEGER NOT NULL DEFAULT 0,
+                deleted_at TEXT
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO clientes_novo (id, nome, cpf, email, telefone, versao, deleted_at)
+            SELECT id, nome, cpf, email, telefone, versao, deleted_at FROM clientes
+        ''')
+        cursor.execute('DROP TABLE clientes')
+        cursor.execute('ALTER TABLE clientes_novo RENAME TO clientes')
+        if sequencia:
+            cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name='clientes'", (sequencia[0],))
+        conn.commit()
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_clientes_cpf_vigentes ON clientes(cpf) WHERE deleted_at IS NULL')
+    
+    # Índices parciais: as consultas só enxergam registros não excluídos
+    for indice in ('idx_fichas_cliente', 'idx_medicamentos_ficha', 'idx_familiares_cliente', 'idx_documentos_cliente'):
+        cursor.execute(f'DROP INDEX IF EXISTS {indice}')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_clientes_vigentes ON clientes(id) WHERE deleted_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_fichas_cliente_vigentes ON fichas(cliente_id, created_at, id) WHERE deleted_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_fichas_saida_vigentes ON fichas(data_saida, cliente_id) WHERE deleted_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_medicamentos_ficha_vigentes ON medicamentos(ficha_id) WHERE deleted_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_familiares_cliente_vigentes ON familiares(cliente_id, nome) WHERE deleted_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_documentos_cliente_vigentes ON documentos(cliente_id, data_upload) WHERE deleted_at IS NULL')
+    
+    # Índices dos excluídos, usados apenas pelo expurgo
+    for tabela in ('clientes', 'fichas', 'medicamentos', 'familiares', 'documentos'):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{tabela}_excluidos ON {tabela}(deleted_at) WHERE deleted_at IS NOT NULL')
+    
     conn.commit()
 
 def validar_cpf(cpf):
@@ -114,6 +231,203 @@ def validar_email(email):
     pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
     return re.match(pattern, email) is not None
 
+def registrar_alteracao(cursor, cliente_id, acao):
+    """Registra a alteração na mesma transação da escrita para o painel ao vivo e os ETags"""
+    cursor.execute('UPDATE clientes SET versao = versao + 1 WHERE id=?', (cliente_id,))
+    cursor.execute('INSERT INTO alteracoes (cliente_id, acao) VALUES (?, ?)', (cliente_id, acao))
+    cursor.execute('DELETE FROM alteracoes WHERE id <= ?', (cursor.lastrowid - MAX_ALTERACOES,))
+
+def contar_fichas(cursor):
+    """Retorna (total de clientes, fichas ativas, fichas finalizadas)"""
+    cursor.execute('SELECT COUNT(*) FROM clientes WHERE deleted_at IS NULL')
+    total = cursor.fetchone()[0]
+    
+    cursor.execute('''
+        SELECT COUNT(*) FROM fichas 
+        WHERE data_saida IS NULL AND deleted_at IS NULL
+        AND cliente_id IN (SELECT id FROM clientes WHERE deleted_at IS NULL)
+    ''')
+    ativos = cursor.fetchone()[0]
+    
+    cursor.execute('''
+        SELECT COUNT(*) FROM fichas 
+        WHERE data_saida IS NOT NULL AND deleted_at IS NULL
+        AND cliente_id IN (SELECT id FROM clientes WHERE deleted_at IS NULL)
+    ''')
+    finalizados = cursor.fetchone()[0]
+    
+    return total, ativos, finalizados
+
+def carregar_cliente_resumo(cursor, cliente_id):
+    """Carrega um cliente com suas fichas no formato usado pelos cards do painel"""
+    cursor.execute('SELECT id, nome, cpf, email, telefone FROM clientes WHERE id=? AND deleted_at IS NULL', (cliente_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    
+    cursor.execute('''
+        SELECT id, data_entrada, data_saida, created_at
+        FROM fichas
+        WHERE cliente_id = ? AND deleted_at IS NULL
+        ORDER BY created_at DESC
+    ''', (cliente_id,))
+    
+    return {
+        'id': row[0],
+        'nome': row[1],
+        'cpf': row[2],
+        'email': row[3],
+        'telefone': row[4],
+        'fichas': [{
+            'id': f[0],
+            'data_entrada': f[1],
+            'data_saida': f[2],
+            'created_at': f[3]
+        } for f in cursor.fetchall()]
+    }
+
+def carregar_fichas(cursor, cliente_id, antes_de=None, limite=FICHAS_POR_PAGINA):
+    """Página de fichas da mais recente para a mais antiga; retorna (fichas, próximo cursor)"""
+    query = '''
+        SELECT id, data_entrada, data_saida, observacoes, created_at
+        FROM fichas
+        WHERE cliente_id = ? AND deleted_at IS NULL
+    '''
+    params = [cliente_id]
+    
+    if antes_de:
+        query += ' AND (created_at, id) < (SELECT created_at, id FROM fichas WHERE id = ?)'
+        params.append(antes_de)
+    
+    query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    params.append(limite + 1)
+    
+    cursor.execute(query, params)
+    fichas = cursor.fetchall()
+    
+    if len(fichas) > limite:
+        fichas = fichas[:limite]
+        return fichas, fichas[-1]['id']
+    return fichas, None
+
+def carregar_medicamentos(cursor, ficha_ids):
+    """Carrega os medicamentos de várias fichas em uma única query"""
+    medicamentos = {ficha_id: [] for ficha_id in ficha_ids}
+    if not ficha_ids:
+        return medicamentos
+    
+    marcadores = ','.join('?' * len(ficha_ids))
+    cursor.execute(f'''
+        SELECT id, nome, dosagem, frequencia, observacoes, ficha_id
+        FROM medicamentos
+        WHERE ficha_id IN ({marcadores}) AND deleted_at IS NULL
+        ORDER BY id
+    ''', list(ficha_ids))
+    
+    for med in cursor.fetchall():
+        medicamentos[med['ficha_id']].append(med)
+    return medicamentos
+
+_assinantes = set()
+_assinantes_lock = threading.Lock()
+_observador = None
+_ultimo_evento = None  # último id de alteracoes já publicado (ou ignorado sem assinantes)
+
+def ultimo_id_alteracoes(cursor):
+    return cursor.execute('SELECT COALESCE(MAX(id), 0) FROM alteracoes').fetchone()[0]
+
+def _formatar_evento(evento, dados, id_evento=None):
+    prefixo = f'id: {id_evento}\n' if id_evento is not None else ''
+    return f'{prefixo}event: {evento}\ndata: {json.dumps(dados)}\n\n'
+
+def _publicar(mensagem, ultimo_id):
+    """Entrega a mensagem já formatada a todos os assinantes; descarta os lentos"""
+    global _ultimo_evento
+    with _assinantes_lock:
+        _ultimo_evento = ultimo_id
+        for fila in list(_assinantes):
+            try:
+                fila.put_nowait(mensagem)
+            except queue.Full:
+                _assinantes.discard(fila)
+                with fila.mutex:
+                    fila.queue.clear()
+                fila.put_nowait(None)
+
+def _observar_alteracoes():
+    """Thread única que detecta commits via PRAGMA data_version e publica os deltas"""
+    global _ultimo_evento
+    conn = get_db()
+    cursor = conn.cursor()
+    versao = None
+    
+    while True:
+        time.sleep(INTERVALO_EVENTOS)
+        
+        try:
+            nova_versao = cursor.execute('PRAGMA data_version').fetchone()[0]
+            if nova_versao == versao:
+                continue
+            versao = nova_versao
+            
+            with _assinantes_lock:
+                ultimo_id = _ultimo_evento
+                if not _assinantes:
+                    # Sem assinantes, apenas acompanha a posição do log sem renderizar nada
+                    _ultimo_evento = ultimo_id_alteracoes(cursor)
+                    continue
+            
+            cursor.execute('SELECT id, cliente_id, acao FROM alteracoes WHERE id > ? ORDER BY id', (ultimo_id,))
+            alteracoes = cursor.fetchall()
+            if not alteracoes:
+                continue
+            ultimo_id = alteracoes[-1][0]
+            
+            # Apenas a última ação de cada cliente interessa ao painel
+            acoes = {}
+            for alteracao in alteracoes:
+                acoes[alteracao[1]] = alteracao[2]
+            
+            mensagens = []
+            for cliente_id, acao in acoes.items():
+                cliente = None if acao == 'removido' else carregar_cliente_resumo(cursor, cliente_id)
+                if cliente is None:
+                    mensagens.append(_formatar_evento('removido', {'id': cliente_id}))
+                    continue
+                with app.app_context():
+                    html = render_template('_cliente_card.html', cliente=cliente)
+                mensagens.append(_formatar_evento('cliente', {'id': cliente_id, 'acao': acao, 'html': html}))
+            
+            total, ativos, finalizados = contar_fichas(cursor)
+            mensagens.append(_formatar_evento('contadores', {'total': total, 'ativos': ativos, 'finalizados': finalizados}, ultimo_id))
+            
+            _publicar(''.join(mensagens), ultimo_id)
+        except Exception as e:
+            app.logger.warning(f'Erro ao observar alterações: {str(e)}')
+
+def _assinar(desde):
+    """Inscreve um navegador; desde é o último id de alteracoes que a página já reflete"""
+    global _observador, _ultimo_evento
+    fila = queue.Queue(maxsize=100)
+    with _assinantes_lock:
+        limite = app.config['MAX_ASSINANTES']
+        if limite is not None and len(_assinantes) >= limite:
+            return None
+        if _ultimo_evento is None:
+            _ultimo_evento = ultimo_id_alteracoes(get_db().cursor())
+        if desde is not None and desde < _ultimo_evento:
+            # Alterações já publicadas antes da inscrição: a página precisa recarregar
+            fila.put_nowait(_formatar_evento('recarregar', {}))
+        _assinantes.add(fila)
+        if _observador is None:
+            _observador = threading.Thread(target=_observar_alteracoes, name='observador-alteracoes', daemon=True)
+            _observador.start()
+    return fila
+
+def _cancelar_assinatura(fila):
+    with _assinantes_lock:
+        _assinantes.discard(fila)
+
 @app.route('/')
 def index():
     try:
@@ -125,22 +439,22 @@ def index():
         data_inicio = request.args.get('data_inicio', '')
         data_fim = request.args.get('data_fim', '')
         
-        # Limpar fichas órfãs (sem cliente)
-        cursor.execute('''
-            DELETE FROM fichas 
-            WHERE cliente_id NOT IN (SELECT id FROM clientes)
-        ''')
-        conn.commit()
+        # Lido antes dos dados: o stream de eventos continua a partir daqui
+        ultimo_evento = ultimo_id_alteracoes(cursor)
         
         query = '''
             SELECT c.id, c.nome, c.cpf, c.email, c.telefone,
                    f.id as ficha_id, f.data_entrada, f.data_saida, f.created_at
             FROM clientes c
-            LEFT JOIN fichas f ON c.id = f.cliente_id
-            WHERE 1=1
+            LEFT JOIN fichas f ON c.id = f.cliente_id AND f.deleted_at IS NULL
         '''
         params = []
         
+        if status == 'excluido':
+            query += ' WHERE c.deleted_at IS NOT NULL'
+        else:
+            query += ' WHERE c.deleted_at IS NULL'
+        
         if busca:
             query += ' AND (c.nome LIKE ? OR c.cpf LIKE ? OR c.email LIKE ?)'
             busca_param = f'%{busca}%'
@@ -187,22 +501,7 @@ def index():
         
         clientes = list(clientes_dict.values())
         
-        cursor.execute('SELECT COUNT(*) FROM clientes')
-        total = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM fichas 
-            WHERE data_saida IS NULL 
-            AND cliente_id IN (SELECT id FROM clientes)
-        ''')
-        ativos = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM fichas 
-            WHERE data_saida IS NOT NULL
-            AND cliente_id IN (SELECT id FROM clientes)
-        ''')
-        finalizados = cursor.fetchone()[0]
+        total, ativos, finalizados = contar_fichas(cursor)
         
         return render_template('index.html', 
                              clientes=clientes, 
@@ -212,10 +511,47 @@ def index():
                              busca=busca,
                              status=status,
                              data_inicio=data_inicio,
-                             data_fim=data_fim)
+                             data_fim=data_fim,
+                             excluidos=status == 'excluido',
+                             ultimo_evento=ultimo_evento,
+                             espera_eventos_lotado=ESPERA_EVENTOS_LOTADO)
     except Exception as e:
         flash(f'Erro ao carregar página: {str(e)}', 'error')
-        return render_template('index.html', clientes=[], total=0, ativos=0, finalizados=0)
+        return render_template('index.html', clientes=[], total=0, ativos=0, finalizados=0,
+                             espera_eventos_lotado=ESPERA_EVENTOS_LOTADO)
+
+@app.route('/eventos')
+def eventos():
+    desde = request.headers.get('Last-Event-ID', type=int)
+    if desde is None:
+        desde = request.args.get('desde', type=int)
+    fila = _assinar(desde)
+    
+    if fila is None:
+        # Cada stream ocupa uma thread do worker; acima do limite, o navegador tenta mais tarde
+        response = Response(f'retry: {ESPERA_EVENTOS_LOTADO * 1000}\n\n', status=503, mimetype='text/event-stream')
+        response.headers['Retry-After'] = str(ESPERA_EVENTOS_LOTADO)
+        return response
+    
+    def gerar():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    mensagem = fila.get(timeout=15)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                if mensagem is None:
+                    break
+                yield mensagem
+        finally:
+            _cancelar_assinatura(fila)
+    
+    response = Response(gerar(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/cadastrar', methods=['GET', 'POST'])
 def cadastrar():
@@ -258,7 +594,7 @@ def cadastrar():
             conn = get_db()
             cursor = conn.cursor()
             
-            cursor.execute('SELECT id, nome FROM clientes WHERE cpf = ?', (cpf_limpo,))
+            cursor.execute('SELECT id, nome FROM clientes WHERE cpf = ? AND deleted_at IS NULL', (cpf_limpo,))
             cliente_existente = cursor.fetchone()
             
             if cliente_existente:
@@ -305,6 +641,7 @@ def cadastrar():
                         VALUES (?, ?, ?, ?, ?, ?, ?)
                     ''', (cliente_id, nome_fam, parentesco, telefone_fam, email_fam, endereco, obs_fam))
             
+            registrar_alteracao(cursor, cliente_id, 'cadastrado')
             conn.commit()
             flash('Novo cliente cadastrado com sucesso!', 'success')
             return redirect(url_for('ver_cliente', cliente_id=cliente_id))
@@ -325,7 +662,7 @@ def nova_ficha(cliente_id):
     conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM clientes WHERE id=?', (cliente_id,))
+    cursor.execute('SELECT * FROM clientes WHERE id=? AND deleted_at IS NULL', (cliente_id,))
     cliente = cursor.fetchone()
     
     if not cliente:
@@ -364,6 +701,7 @@ def nova_ficha(cliente_id):
                         VALUES (?, ?, ?, ?, ?)
                     ''', (ficha_id, nome_med, dosagem, frequencia, obs_med))
             
+            registrar_alteracao(cursor, cliente_id, 'internado')
             conn.commit()
             flash('Nova ficha criada com sucesso!', 'success')
             return redirect(url_for('ver_cliente', cliente_id=cliente_id))
@@ -379,29 +717,19 @@ def ver_cliente(cliente_id):
     conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM clientes WHERE id=?', (cliente_id,))
+    cursor.execute('SELECT * FROM clientes WHERE id=? AND deleted_at IS NULL', (cliente_id,))
     cliente = cursor.fetchone()
     
     if not cliente:
         flash('Cliente não encontrado!', 'error')
         return redirect(url_for('index'))
     
-    cursor.execute('''
-        SELECT id, data_entrada, data_saida, observacoes, created_at
-        FROM fichas
-        WHERE cliente_id = ?
-        ORDER BY created_at DESC
-    ''', (cliente_id,))
-    fichas = cursor.fetchall()
+    fichas, proximo_cursor = carregar_fichas(cursor, cliente_id)
+    medicamentos_por_ficha = carregar_medicamentos(cursor, [ficha[0] for ficha in fichas])
     
     fichas_com_medicamentos = []
     for ficha in fichas:
-        cursor.execute('''
-            SELECT id, nome, dosagem, frequencia, observacoes
-            FROM medicamentos
-            WHERE ficha_id = ?
-        ''', (ficha[0],))
-        medicamentos = cursor.fetchall()
+        medicamentos = medicamentos_por_ficha[ficha[0]]
         
         fichas_com_medicamentos.append({
             'id': ficha[0],
@@ -415,7 +743,7 @@ def ver_cliente(cliente_id):
     cursor.execute('''
         SELECT id, nome, parentesco, telefone, email, endereco, observacoes
         FROM familiares
-        WHERE cliente_id = ?
+        WHERE cliente_id = ? AND deleted_at IS NULL
         ORDER BY nome
     ''', (cliente_id,))
     familiares = cursor.fetchall()
@@ -423,12 +751,12 @@ def ver_cliente(cliente_id):
     cursor.execute('''
         SELECT id, nome_original, tipo_documento, tamanho, data_upload, observacoes
         FROM documentos
-        WHERE cliente_id = ?
+        WHERE cliente_id = ? AND deleted_at IS NULL
         ORDER BY data_upload DESC
     ''', (cliente_id,))
     documentos = cursor.fetchall()
     
-    return render_template('ver_cliente.html', cliente=cliente, fichas=fichas_com_medicamentos, familiares=familiares, documentos=documentos)
+    return render_template('ver_cliente.html', cliente=cliente, fichas=fichas_com_medicamentos, proximo_cursor=proximo_cursor, limite_api=LIMITE_API, familiares=familiares, documentos=documentos)
 
 @app.route('/editar/<int:id>', methods=['GET', 'POST'])
 def editar(id):
@@ -455,10 +783,15 @@ def editar(id):
             cursor.execute('''
                 UPDATE clientes 
                 SET nome=?, email=?, telefone=?
-                WHERE id=?
+                WHERE id=? AND deleted_at IS NULL
             ''', (nome, email, telefone, id))
             
-            cursor.execute('DELETE FROM familiares WHERE cliente_id=?', (id,))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                flash('Cliente não encontrado!', 'error')
+                return redirect(url_for('index'))
+            
+            cursor.execute('UPDATE familiares SET deleted_at = CURRENT_TIMESTAMP WHERE cliente_id=? AND deleted_at IS NULL', (id,))
             
             for fam in familiares:
                 nome_fam = fam.get('nome', '').strip()
@@ -474,6 +807,7 @@ def editar(id):
                         VALUES (?, ?, ?, ?, ?, ?, ?)
                     ''', (id, nome_fam, parentesco, telefone_fam, email_fam, endereco, obs_fam))
             
+            registrar_alteracao(cursor, id, 'atualizado')
             conn.commit()
             flash('Cliente atualizado com sucesso!', 'success')
             return redirect(url_for('ver_cliente', cliente_id=id))
@@ -482,10 +816,14 @@ def editar(id):
             flash(f'Erro ao atualizar: {str(e)}', 'error')
             return redirect(url_for('editar', id=id))
     
-    cursor.execute('SELECT * FROM clientes WHERE id=?', (id,))
+    cursor.execute('SELECT * FROM clientes WHERE id=? AND deleted_at IS NULL', (id,))
     cliente = cursor.fetchone()
     
-    cursor.execute('SELECT * FROM familiares WHERE cliente_id=?', (id,))
+    if not cliente:
+        flash('Cliente não encontrado!', 'error')
+        return redirect(url_for('index'))
+    
+    cursor.execute('SELECT * FROM familiares WHERE cliente_id=? AND deleted_at IS NULL', (id,))
     familiares = cursor.fetchall()
     familiares_json = json.dumps([dict(f) for f in familiares])
     
@@ -500,7 +838,7 @@ def editar_ficha(ficha_id):
         SELECT f.*, c.nome, c.cpf
         FROM fichas f
         JOIN clientes c ON f.cliente_id = c.id
-        WHERE f.id = ?
+        WHERE f.id = ? AND f.deleted_at IS NULL AND c.deleted_at IS NULL
     ''', (ficha_id,))
     ficha = cursor.fetchone()
     
@@ -528,7 +866,7 @@ def editar_ficha(ficha_id):
                 WHERE id=?
             ''', (data_entrada, data_saida, observacoes, ficha_id))
             
-            cursor.execute('DELETE FROM medicamentos WHERE ficha_id=?', (ficha_id,))
+            cursor.execute('UPDATE medicamentos SET deleted_at = CURRENT_TIMESTAMP WHERE ficha_id=? AND deleted_at IS NULL', (ficha_id,))
             
             for med in medicamentos:
                 nome_med = med.get('nome', '').strip()
@@ -542,6 +880,7 @@ def editar_ficha(ficha_id):
                         VALUES (?, ?, ?, ?, ?)
                     ''', (ficha_id, nome_med, dosagem, frequencia, obs_med))
             
+            registrar_alteracao(cursor, ficha[1], 'alta' if data_saida and not ficha['data_saida'] else 'atualizado')
             conn.commit()
             flash('Ficha atualizada com sucesso!', 'success')
             return redirect(url_for('ver_cliente', cliente_id=ficha[1]))
@@ -550,7 +889,7 @@ def editar_ficha(ficha_id):
             flash(f'Erro ao atualizar ficha: {str(e)}', 'error')
             return redirect(url_for('editar_ficha', ficha_id=ficha_id))
     
-    cursor.execute('SELECT * FROM medicamentos WHERE ficha_id=?', (ficha_id,))
+    cursor.execute('SELECT * FROM medicamentos WHERE ficha_id=? AND deleted_at IS NULL', (ficha_id,))
     medicamentos = cursor.fetchall()
     medicamentos_json = json.dumps([dict(m) for m in medicamentos])
     
@@ -562,7 +901,12 @@ def deletar(id):
         conn = get_db()
         cursor = conn.cursor()
         cursor.execute('BEGIN IMMEDIATE')
-        cursor.execute('DELETE FROM clientes WHERE id=?', (id,))
+        cursor.execute('UPDATE clientes SET deleted_at = CURRENT_TIMESTAMP WHERE id=? AND deleted_at IS NULL', (id,))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            flash('Cliente não encontrado!', 'error')
+            return redirect(url_for('index'))
+        registrar_alteracao(cursor, id, 'removido')
         conn.commit()
         flash('Cliente removido com sucesso!', 'success')
     except Exception as e:
@@ -575,19 +919,50 @@ def deletar(id):
     response.headers['Expires'] = '0'
     return response
 
+@app.route('/restaurar/<int:id>')
+def restaurar(id):
+    try:
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        # deletar() só marca a linha do cliente; fichas e familiares voltam a aparecer com ela
+        cursor.execute('''
+            UPDATE clientes SET deleted_at = NULL
+            WHERE id=? AND deleted_at >= datetime('now', ?)
+        ''', (id, RETENCAO_EXCLUIDOS))
+        
+        if cursor.rowcount == 0:
+            conn.rollback()
+            flash('Cliente excluído não encontrado ou fora do período de retenção!', 'error')
+            return redirect(url_for('index', status='excluido'))
+        
+        registrar_alteracao(cursor, id, 'cadastrado')
+        conn.commit()
+        flash('Cliente restaurado com sucesso!', 'success')
+        return redirect(url_for('ver_cliente', cliente_id=id))
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        flash('Não é possível restaurar: o CPF já pertence a outro cliente cadastrado.', 'error')
+    except Exception as e:
+        conn.rollback()
+        flash(f'Erro ao restaurar: {str(e)}', 'error')
+    
+    return redirect(url_for('index', status='excluido'))
+
 @app.route('/deletar-ficha/<int:ficha_id>')
 def deletar_ficha(ficha_id):
     try:
         conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT cliente_id FROM fichas WHERE id=?', (ficha_id,))
+        cursor.execute('SELECT cliente_id FROM fichas WHERE id=? AND deleted_at IS NULL', (ficha_id,))
         result = cursor.fetchone()
         
         if result:
             cliente_id = result[0]
             cursor.execute('BEGIN IMMEDIATE')
-            cursor.execute('DELETE FROM fichas WHERE id=?', (ficha_id,))
+            cursor.execute('UPDATE fichas SET deleted_at = CURRENT_TIMESTAMP WHERE id=?', (ficha_id,))
+            registrar_alteracao(cursor, cliente_id, 'atualizado')
             conn.commit()
             flash('Ficha removida com sucesso!', 'success')
             response = redirect(url_for('ver_cliente', cliente_id=cliente_id))
@@ -613,8 +988,9 @@ def exportar_csv():
                    f.data_entrada, f.data_saida, f.observacoes,
                    m.nome as medicamento, m.dosagem, m.frequencia
             FROM clientes c
-            LEFT JOIN fichas f ON c.id = f.cliente_id
-            LEFT JOIN medicamentos m ON f.id = m.ficha_id
+            LEFT JOIN fichas f ON c.id = f.cliente_id AND f.deleted_at IS NULL
+            LEFT JOIN medicamentos m ON f.id = m.ficha_id AND m.deleted_at IS NULL
+            WHERE c.deleted_at IS NULL
             ORDER BY c.nome, f.data_entrada DESC
         ''')
         
@@ -669,6 +1045,7 @@ def upload_documento(cliente_id):
                 INSERT INTO documentos (cliente_id, nome_arquivo, nome_original, tipo_documento, tamanho, observacoes)
                 VALUES (?, ?, ?, ?, ?, ?)
             ''', (cliente_id, nome_arquivo, nome_original, tipo_documento, tamanho, observacoes))
+            registrar_alteracao(cursor, cliente_id, 'atualizado')
             conn.commit()
             flash('Documento enviado com sucesso!', 'success')
         except Exception as e:
@@ -685,7 +1062,7 @@ def download_documento(doc_id):
     try:
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('SELECT nome_arquivo, nome_original FROM documentos WHERE id=?', (doc_id,))
+        cursor.execute('SELECT nome_arquivo, nome_original FROM documentos WHERE id=? AND deleted_at IS NULL', (doc_id,))
         documento = cursor.fetchone()
         
         if not documento:
@@ -709,28 +1086,419 @@ def deletar_documento(doc_id):
         conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT nome_arquivo, cliente_id FROM documentos WHERE id=?', (doc_id,))
+        cursor.execute('SELECT cliente_id FROM documentos WHERE id=? AND deleted_at IS NULL', (doc_id,))
         documento = cursor.fetchone()
         
         if not documento:
             flash('Documento não encontrado!', 'error')
             return redirect(url_for('index'))
         
-        cliente_id = documento[1]
-        caminho_arquivo = os.path.join(app.config['UPLOAD_FOLDER'], documento[0])
+        cliente_id = documento[0]
         
-        cursor.execute('DELETE FROM documentos WHERE id=?', (doc_id,))
+        # O arquivo só é apagado pelo expurgo, após o período de retenção
+        cursor.execute('UPDATE documentos SET deleted_at = CURRENT_TIMESTAMP WHERE id=?', (doc_id,))
+        registrar_alteracao(cursor, cliente_id, 'atualizado')
         conn.commit()
         
-        if os.path.exists(caminho_arquivo):
-            os.remove(caminho_arquivo)
-        
         flash('Documento removido com sucesso!', 'success')
         return redirect(url_for('ver_cliente', cliente_id=cliente_id))
     except Exception as e:
         flash(f'Erro ao deletar documento: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+def _versao_cliente(cursor, cliente_id):
+    cursor.execute('SELECT versao FROM clientes WHERE id=? AND deleted_at IS NULL', (cliente_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def _paginacao():
+    """Lê pagina/limite da query string dentro dos limites da API"""
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    limite = min(max(request.args.get('limite', 50, type=int), 1), LIMITE_API)
+    return pagina, limite
+
+def _responder_com_etag(cliente_id, versao, secao, carregar):
+    """Responde 304 se o ETag fraco (versão do cliente + parâmetros) não mudou; senão executa carregar()"""
+    parametros = hashlib.md5(request.query_string).hexdigest()[:8]
+    etag = f'{cliente_id}-{versao}-{secao}-{parametros}'
+    
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify(carregar())
+    
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/clientes/<int:cliente_id>/fichas')
+def api_fichas(cliente_id):
+    cursor = get_db().cursor()
+    versao = _versao_cliente(cursor, cliente_id)
+    if versao is None:
+        return jsonify({'erro': 'Cliente não encontrado'}), 404
+    
+    antes_de = request.args.get('cursor', type=int)
+    limite = min(max(request.args.get('limite', FICHAS_POR_PAGINA, type=int), 1), LIMITE_API)
+    
+    if 'cursor' in request.args:
+        cursor.execute('SELECT 1 FROM fichas WHERE id=? AND cliente_id=?', (antes_de, cliente_id))
+        if antes_de is None or not cursor.fetchone():
+            return jsonify({'erro': 'Cursor inválido'}), 400
+    
+    def carregar():
+        fichas, proximo_cursor = carregar_fichas(cursor, cliente_id, antes_de, limite)
+        return {'itens': [dict(f) for f in fichas], 'proximo_cursor': proximo_cursor}
+    
+    return _responder_com_etag(cliente_id, versao, 'fichas', carregar)
+
+@app.route('/api/fichas/<int:ficha_id>/medicamentos')
+def api_medicamentos(ficha_id):
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT c.id, c.versao
+        FROM fichas f
+        JOIN clientes c ON f.cliente_id = c.id
+        WHERE f.id = ? AND f.deleted_at IS NULL AND c.deleted_at IS NULL
+    ''', (ficha_id,))
+    row = cursor.fetchone()
+    if not row:
+        return jsonify({'erro': 'Ficha não encontrada'}), 404
+    
+    pagina, limite = _paginacao()
+    
+    def carregar():
+        cursor.execute('''
+            SELECT id, nome, dosagem, frequencia, observacoes
+            FROM medicamentos
+            WHERE ficha_id = ? AND deleted_at IS NULL
+            ORDER BY id
+            LIMIT ? OFFSET ?
+        ''', (ficha_id, limite + 1, (pagina - 1) * limite))
+        itens = cursor.fetchall()
+        return {
+            'itens': [dict(m) for m in itens[:limite]],
+            'proxima_pagina': pagina + 1 if len(itens) > limite else None
+        }
+    
+    return _responder_com_etag(row[0], row[1], f'medicamentos-{ficha_id}', carregar)
+
+@app.route('/api/clientes/<int:cliente_id>/familiares')
+def api_familiares(cliente_id):
+    cursor = get_db().cursor()
+    versao = _versao_cliente(cursor, cliente_id)
+    if versao is None:
+        return jsonify({'erro': 'Cliente não encontrado'}), 404
+    
+    pagina, limite = _paginacao()
+    
+    def carregar():
+        cursor.execute('''
+            SELECT id, nome, parentesco, telefone, email, endereco, observacoes
+            FROM familiares
+            WHERE cliente_id = ? AND deleted_at IS NULL
+            ORDER BY nome, id
+            LIMIT ? OFFSET ?
+        ''', (cliente_id, limite + 1, (pagina - 1) * limite))
+        itens = cursor.fetchall()
+        return {
+            'itens': [dict(f) for f in itens[:limite]],
+            'proxima_pagina': pagina + 1 if len(itens) > limite else None
+        }
+    
+    return _responder_com_etag(cliente_id, versao, 'familiares', carregar)
+
+@app.route('/api/clientes/<int:cliente_id>/documentos')
+def api_documentos(cliente_id):
+    cursor = get_db().cursor()
+    versao = _versao_cliente(cursor, cliente_id)
+    if versao is None:
+        return jsonify({'erro': 'Cliente não encontrado'}), 404
+    
+    pagina, limite = _paginacao()
+    
+    def carregar():
+        cursor.execute('''
+            SELECT id, nome_original, tipo_documento, tamanho, data_upload, observacoes
+            FROM documentos
+            WHERE cliente_id = ? AND deleted_at IS NULL
+            ORDER BY data_upload DESC, id DESC
+            LIMIT ? OFFSET ?
+        ''', (cliente_id, limite + 1, (pagina - 1) * limite))
+        itens = cursor.fetchall()
+        return {
+            'itens': [dict(d) for d in itens[:limite]],
+            'proxima_pagina': pagina + 1 if len(itens) > limite else None
+        }
+    
+    return _responder_com_etag(cliente_id, versao, 'documentos', carregar)
+
+@app.route('/saude')
+def saude():
+    """Health check leve: só leitura, nunca abre transação de escrita"""
+    try:
+        get_db().execute('SELECT 1').fetchone()
+    except sqlite3.Error as e:
+        return jsonify({'status': 'erro', 'erro': str(e), 'pid': os.getpid()}), 503
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+def aquecer_worker():
+    """Compila templates e prepara conexões de leitura antes de aceitar tráfego"""
+    espera = 1
+    for tentativa in range(1, TENTATIVAS_AQUECIMENTO + 1):
+        try:
+            _aquecer()
+            return
+        except sqlite3.Error as e:
+            fechar_db()
+            if tentativa == TENTATIVAS_AQUECIMENTO:
+                raise
+            app.logger.warning(f'Falha ao aquecer worker (tentativa {tentativa}): {str(e)}; nova tentativa em {espera}s')
+            time.sleep(espera)
+            espera *= 2
+
+def _aquecer():
+    for nome in app.jinja_env.list_templates():
+        app.jinja_env.get_template(nome)
+    
+    for _ in range(CONEXOES_AQUECIDAS):
+        conn = _nova_conexao()
+        cursor = conn.cursor()
+        # Percorre as tabelas e índices para carregar o cache de páginas
+        for tabela in ('clientes', 'fichas', 'medicamentos', 'familiares', 'documentos'):
+            cursor.execute(f'SELECT COUNT(*) FROM {tabela} WHERE deleted_at IS NULL').fetchone()
+        # Executa as queries mais usadas para deixá-las no cache de statements
+        contar_fichas(cursor)
+        carregar_cliente_resumo(cursor, 0)
+        carregar_fichas(cursor, 0)
+        _versao_cliente(cursor, 0)
+        _pool.put(conn)
+
+def encerrar_eventos():
+    """Fecha os streams SSE deste processo para que os navegadores reconectem em outro worker"""
+    with _assinantes_lock:
+        for fila in _assinantes:
+            with fila.mutex:
+                fila.queue.clear()
+            fila.put_nowait(None)
+        _assinantes.clear()
+
+_parar_expurgo = threading.Event()
+
+def _em_lotes(conn, sql, params):
+    """Repete o statement em transações curtas de até LOTE_EXPURGO linhas"""
+    total = 0
+    while not _parar_expurgo.is_set():
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(sql, (*params, LOTE_EXPURGO))
+            afetadas = cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        total += afetadas
+        if afetadas < LOTE_EXPURGO:
+            break
+        time.sleep(PAUSA_EXPURGO)
+    return total
+
+def _expurgar_documentos(conn):
+    """Remove documentos excluídos e, após o commit de cada lote, seus arquivos"""
+    total = 0
+    while not _parar_expurgo.is_set():
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT id, nome_arquivo FROM documentos
+                WHERE deleted_at < datetime('now', ?)
+                LIMIT ?
+            ''', (RETENCAO_EXCLUIDOS, LOTE_EXPURGO))
+            documentos = cursor.fetchall()
+            cursor.executemany('DELETE FROM documentos WHERE id=?', [(doc[0],) for doc in documentos])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        
+        for doc in documentos:
+            caminho_arquivo = os.path.join(app.config['UPLOAD_FOLDER'], doc[1])
+            if os.path.exists(caminho_arquivo):
+                os.remove(caminho_arquivo)
+        
+        total += len(documentos)
+        if len(documentos) < LOTE_EXPURGO:
+            break
+        time.sleep(PAUSA_EXPURGO)
+    return total
+
+def expurgar_excluidos():
+    """Apaga definitivamente os registros excluídos há mais que RETENCAO_EXCLUIDOS"""
+    conn = get_db()
+    
+    # Registros órfãos (cliente/ficha removidos fisicamente) passam a contar como excluídos
+    # a partir de agora, cumprindo o período de retenção como qualquer outro
+    for tabela, coluna, pai in (('fichas', 'cliente_id', 'clientes'), ('familiares', 'cliente_id', 'clientes'),
+                                ('documentos', 'cliente_id', 'clientes'), ('medicamentos', 'ficha_id', 'fichas')):
+        _em_lotes(conn, f'''
+            UPDATE {tabela} SET deleted_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM {tabela}
+                WHERE deleted_at IS NULL AND {coluna} NOT IN (SELECT id FROM {pai})
+                LIMIT ?
+            )
+        ''', ())
+    
+    # Filhos herdam a data de exclusão do pai vencido, para serem apagados antes dele
+    for tabela, coluna, pai in (('fichas', 'cliente_id', 'clientes'), ('familiares', 'cliente_id', 'clientes'),
+                                ('documentos', 'cliente_id', 'clientes'), ('medicamentos', 'ficha_id', 'fichas')):
+        _em_lotes(conn, f'''
+            UPDATE {tabela} SET deleted_at = (SELECT p.deleted_at FROM {pai} p WHERE p.id = {tabela}.{coluna})
+            WHERE id IN (
+                SELECT t.id FROM {pai} p
+                JOIN {tabela} t ON t.{coluna} = p.id AND t.deleted_at IS NULL
+                WHERE p.deleted_at < datetime('now', ?)
+                LIMIT ?
+            )
+        ''', (RETENCAO_EXCLUIDOS,))
+    
+    removidos = _expurgar_documentos(conn)
+    for tabela in ('medicamentos', 'familiares', 'fichas', 'clientes'):
+        removidos += _em_lotes(conn, f'''
+            DELETE FROM {tabela}
+            WHERE id IN (
+                SELECT id FROM {tabela}
+                WHERE deleted_at < datetime('now', ?)
+                LIMIT ?
+            )
+        ''', (RETENCAO_EXCLUIDOS,))
+    return removidos
+
+def _loop_expurgo():
+    while not _parar_expurgo.is_set():
+        try:
+            removidos = expurgar_excluidos()
+            if removidos:
+                app.logger.info(f'Expurgo removeu {removidos} registros excluídos')
+        except Exception as e:
+            app.logger.warning(f'Erro no expurgo: {str(e)}')
+        _parar_expurgo.wait(INTERVALO_EXPURGO)
+
+def _executar_expurgo():
+    """Processo dedicado ao expurgo; SIGTERM interrompe entre lotes"""
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: _parar_expurgo.set())
+    _loop_expurgo()
+    os._exit(0)
+
+def _comando_app(*argumentos):
+    """Linha de comando para rodar app.py em um processo novo, com o código atual do disco"""
+    return [sys.executable, os.path.abspath(__file__), *argumentos]
+
+def servir(host='0.0.0.0', port=5000, workers=4, threads=16):
+    """Servidor de produção (gunicorn): SIGHUP recarrega código e workers, SIGTERM encerra"""
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.arbiter import Arbiter
+    
+    expurgo = {'processo': None}
+    
+    def migrar():
+        # Em processo separado para que, após um SIGHUP, as migrações do código novo rodem
+        subprocess.run(_comando_app('migrar'), check=True)
+    
+    def iniciar_expurgo():
+        parar_expurgo()
+        expurgo['processo'] = subprocess.Popen(_comando_app('expurgar', '--continuo'))
+    
+    def parar_expurgo():
+        processo = expurgo['processo']
+        if processo is not None and processo.poll() is None:
+            processo.terminate()
+            processo.wait()
+    
+    class Arbitro(Arbiter):
+        def handle_hup(self):
+            # Migra antes do reload; se falhar, a geração atual continua atendendo com o esquema antigo
+            try:
+                migrar()
+            except subprocess.CalledProcessError as e:
+                app.logger.error(f'Migração falhou, reload cancelado: {str(e)}')
+                return
+            super().handle_hup()
+    
+    def post_worker_init(worker):
+        modulo = sys.modules['app']
+        try:
+            modulo.aquecer_worker()
+        except Exception:
+            # O worker não conclui o boot e o gunicorn encerra o servidor em vez de reiniciá-lo em loop
+            modulo.app.logger.exception('Worker não pôde ser aquecido')
+            raise
+        
+        # Streams SSE nunca tomam todas as threads: o restante atende páginas e o health check
+        modulo.app.config['MAX_ASSINANTES'] = max(worker.cfg.threads - modulo.THREADS_RESERVADAS, worker.cfg.threads // 2)
+        
+        encerrar_padrao = signal.getsignal(signal.SIGTERM)
+        def encerrar(signum, frame):
+            threading.Thread(target=modulo.encerrar_eventos, daemon=True).start()
+            encerrar_padrao(signum, frame)
+        signal.signal(signal.SIGTERM, encerrar)
+    
+    class Servidor(BaseApplication):
+        def load_config(self):
+            opcoes = {
+                'bind': f'{host}:{port}',
+                'workers': workers,
+                'worker_class': 'gthread',
+                'threads': threads,
+                'graceful_timeout': TEMPO_ENCERRAMENTO,
+                'preload_app': False,
+                'when_ready': lambda server: iniciar_expurgo(),
+                'on_reload': lambda server: iniciar_expurgo(),
+                'on_exit': lambda server: parar_expurgo(),
+                'post_worker_init': post_worker_init,
+            }
+            for chave, valor in opcoes.items():
+                self.cfg.set(chave, valor)
+        
+        def load(self):
+            # Cada worker importa app.py do disco; assim um reload carrega o código novo
+            sys.modules.pop('app', None)
+            return importlib.import_module('app').app
+        
+        def run(self):
+            Arbitro(self).run()
+    
+    migrar()
+    Servidor().run()
+
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    parser = argparse.ArgumentParser(description='Sistema de Gerenciamento de Reabilitação')
+    subcomandos = parser.add_subparsers(dest='comando')
+    parser_servir = subcomandos.add_parser('servir', help='servidor de produção com múltiplos processos')
+    parser_servir.add_argument('--host', default='0.0.0.0')
+    parser_servir.add_argument('--port', type=int, default=5000)
+    parser_servir.add_argument('--workers', type=int, default=4)
+    parser_servir.add_argument('--threads', type=int, default=16, help='threads por worker; abas com o painel ao vivo usam no máximo threads - 4 (ou metade)')
+    subcomandos.add_parser('migrar', help='cria/atualiza o esquema do banco')
+    parser_expurgar = subcomandos.add_parser('expurgar', help='apaga definitivamente os registros excluídos vencidos')
+    parser_expurgar.add_argument('--continuo', action='store_true', help='repete a cada INTERVALO_EXPURGO segundos')
+    args = parser.parse_args()
+    
+    if args.comando == 'servir':
+        servir(args.host, args.port, args.workers, args.threads)
+    elif args.comando == 'migrar':
+        init_db()
+    elif args.comando == 'expurgar':
+        if args.continuo:
+            _executar_expurgo()
+        init_db()
+        print(f'{expurgar_excluidos()} registros removidos')
+    else:
+        init_db()
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            threading.Thread(target=_loop_expurgo, name='expurgo', daemon=True).start()
+        app.run(debug=True, host='0.0.0.0', port=5000)